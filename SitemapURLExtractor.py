@@ -1,16 +1,22 @@
 import os
-import pandas as pd
+import json
+from pathlib import Path
+from contextlib import asynccontextmanager, closing
 from urllib.parse import urlparse
 from datetime import datetime
 import asyncio
-import aiohttp
-from bs4 import BeautifulSoup
+import httpx
+from lxml import etree
 import logging
 import platform
+import sqlite3
+import ssl
+import zlib
 from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
 import colorama
 from colorama import Fore, Style
-import random
+import itertools
 import re
 
 # Initialize colorama
@@ -19,133 +25,405 @@ colorama.init()
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# httpx logs every request at INFO level, which would flood the progress bar
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
-# Define colors for random selection
+# Define colors to cycle through
 COLORS = [Fore.CYAN, Fore.GREEN, Fore.YELLOW, Fore.MAGENTA, Fore.BLUE, Fore.RED]
+RESET = Style.RESET_ALL
 
-def get_random_color():
-    """Get a random color"""
-    return random.choice(COLORS)
+# Sitemap entry tags; the {*} wildcard matches any namespace, or none, so
+# sitemaps with a mistyped or legacy namespace are still read
+URL_TAG = '{*}url'
+LOC_TAG = '{*}loc'
+SITEMAP_TAG = '{*}sitemap'
 
-async def fetch_sitemap(session, sitemap_url):
-    """Fetch sitemap XML content asynchronously"""
+# Characters not allowed in output file names
+UNSAFE_FILENAME_CHARS = re.compile(r'[^a-zA-Z0-9_\-\.]')
+
+# Default request headers, sent with every request of the client
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Encoding': 'gzip, deflate'
+}
+
+# Size of each response chunk fed to the XML parser
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of a gzip stream
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Number of workers fetching sitemaps at once (override with CONCURRENCY env var);
+# at least one worker is needed or the crawl queue is never drained
+CONCURRENCY = max(1, int(os.environ.get('CONCURRENCY', 64)))
+
+# Maximum parallel requests to a single host; hosts that answer over HTTP/2
+# multiplex requests on one connection and are not limited
+PER_HOST_LIMIT = 8
+
+# Overall time limit in seconds for fetching and parsing one sitemap
+FETCH_TIMEOUT = 60
+
+# SQLite file caching ETag/Last-Modified validators and parsed URLs per sitemap
+CACHE_FILENAME = 'sitemap_cache.sqlite3'
+
+_color_cycle = itertools.cycle(COLORS)
+_host_semaphores = {}
+_http2_hosts = set()
+
+def get_color():
+    """Get the next color in the cycle"""
+    return next(_color_cycle)
+
+async def stream_parse(response):
+    """Parse sitemap XML as the response body streams in.
+
+    Returns the unique page URLs and the child sitemap URLs listed when the
+    document is a sitemap index.
+    """
+    # Let lxml filter events by tag in C so only entry elements reach Python
+    parser = etree.XMLPullParser(events=('end',), tag=(URL_TAG, SITEMAP_TAG))
+    seen = set()
+    urls = []
+    child_sitemaps = []
+
+    decompressor = None
+    first_chunk = True
+
+    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+        # .xml.gz files served as-is (without Content-Encoding) arrive still
+        # gzipped; detect them by their magic bytes and inflate on the fly
+        if first_chunk:
+            first_chunk = False
+            if chunk.startswith(GZIP_MAGIC):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            # Tags look like '{namespace}sitemap' or a bare 'sitemap'
+            is_index_entry = element.tag.rpartition('}')[2] == 'sitemap'
+
+            loc = element.find(LOC_TAG)
+            if loc is not None and loc.text:
+                url = loc.text.strip()
+                if is_index_entry:
+                    child_sitemaps.append(url)
+                # Keep only the first occurrence of each URL
+                elif url not in seen:
+                    seen.add(url)
+                    urls.append(url)
+
+            # Drop parsed elements so memory stays flat on large sitemaps
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+    if decompressor is not None:
+        parser.feed(decompressor.flush())
+    parser.close()
+    return urls, child_sitemaps
+
+@asynccontextmanager
+async def host_slot(host):
+    """Hold one of the host's PER_HOST_LIMIT request slots.
+
+    Hosts already seen answering over HTTP/2 are not limited.
+    """
+    if host in _http2_hosts:
+        yield
+        return
+
+    if host not in _host_semaphores:
+        _host_semaphores[host] = asyncio.Semaphore(PER_HOST_LIMIT)
+    async with _host_semaphores[host]:
+        yield
+
+async def download_sitemap(client, sitemap_url, headers):
+    """Request a sitemap and stream-parse its body if the server returns 200"""
+    async with client.stream('GET', sitemap_url, headers=headers) as response:
+        if response.status_code == 200:
+            return response, await stream_parse(response)
+        return response, None
+
+def connect_cache(cache_filename):
+    """Connect to a cache database and create its table if needed"""
+    cache = sqlite3.connect(cache_filename)
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xml;q=0.9,*/*;q=0.8'
-        }
-        async with session.get(sitemap_url, headers=headers) as response:
-            if response.status == 200:
-                content = await response.text()
-                return content
-            else:
-                logger.error(f"{Fore.RED}Error fetching {sitemap_url}: HTTP {response.status}{Style.RESET_ALL}")
-                return None
-    except Exception as e:
-        logger.error(f"{Fore.RED}Exception fetching {sitemap_url}: {str(e)}{Style.RESET_ALL}")
+        cache.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, urls_json TEXT, sitemaps_json TEXT)'
+        )
+    except sqlite3.Error:
+        cache.close()
+        raise
+    return cache
+
+def open_cache(cache_filename):
+    """Open the sitemap cache database.
+
+    A corrupt cache file is rebuilt. If the file can't be used for any other
+    reason (e.g. another run holds its lock), or rebuilding fails, the file is
+    left alone and the run continues with an in-memory cache.
+    """
+    try:
+        return connect_cache(cache_filename)
+    except sqlite3.OperationalError as e:
+        # Locked, unreadable or unwritable: not ours to delete
+        logger.warning(f"{Fore.YELLOW}Cannot open cache {cache_filename} ({str(e)}), running without it{RESET}")
+        return connect_cache(':memory:')
+    except sqlite3.DatabaseError as e:
+        logger.warning(f"{Fore.YELLOW}Cache {cache_filename} is corrupt ({str(e)}), rebuilding it{RESET}")
+
+    try:
+        os.remove(cache_filename)
+        return connect_cache(cache_filename)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"{Fore.YELLOW}Cannot rebuild cache {cache_filename} ({str(e)}), running without it{RESET}")
+        return connect_cache(':memory:')
+
+def load_cache_entry(cache, sitemap_url):
+    """Look up a sitemap in the cache; a cache error counts as a miss"""
+    try:
+        return cache.execute(
+            'SELECT etag, last_modified, urls_json, sitemaps_json FROM cache WHERE url = ?',
+            (sitemap_url,),
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"{Fore.YELLOW}Cache lookup failed for {sitemap_url}: {str(e)}{RESET}")
         return None
 
-def parse_sitemap(content):
-    """Parse sitemap XML content and extract URLs"""
+def store_cache_entry(cache, sitemap_url, etag, last_modified, urls, child_sitemaps):
+    """Store a parsed sitemap and its validators; cache errors are only logged"""
+    try:
+        cache.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+            (sitemap_url, etag, last_modified, json.dumps(urls), json.dumps(child_sitemaps)),
+        )
+    except sqlite3.Error as e:
+        logger.warning(f"{Fore.YELLOW}Cache update failed for {sitemap_url}: {str(e)}{RESET}")
+
+async def fetch_and_parse(client, cache, sitemap_url):
+    """Fetch a sitemap asynchronously and extract its URLs while downloading.
+
+    Sends the validators cached from the previous run so unchanged sitemaps
+    come back as 304 Not Modified and are served from the cache instead.
+    """
     try:
-        soup = BeautifulSoup(content, 'xml')
-        urls = []
+        cached = load_cache_entry(cache, sitemap_url)
 
-        url_tags = soup.find_all('url')
-        for url in url_tags:
-            loc = url.find('loc')
-            if loc:
-                urls.append(loc.text.strip())
+        headers = {}
+        if cached:
+            etag, last_modified = cached[0], cached[1]
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
 
-        return urls
+        # Wait for a host slot before starting the clock, so time spent queued
+        # behind other requests to the same host doesn't count as a timeout
+        host = urlparse(sitemap_url).netloc
+        async with host_slot(host):
+            response, parsed = await asyncio.wait_for(
+                download_sitemap(client, sitemap_url, headers), FETCH_TIMEOUT
+            )
+        if response.http_version == 'HTTP/2':
+            _http2_hosts.add(host)
+
+        if response.status_code == 304 and cached:
+            return json.loads(cached[2]), json.loads(cached[3])
+        elif parsed is not None:
+            urls, child_sitemaps = parsed
+
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                store_cache_entry(cache, sitemap_url, etag, last_modified, urls, child_sitemaps)
+
+            return urls, child_sitemaps
+        else:
+            logger.error(f"{Fore.RED}Error fetching {sitemap_url}: HTTP {response.status_code}{RESET}")
+            return None
+    except asyncio.TimeoutError:
+        logger.error(f"{Fore.RED}Timed out fetching {sitemap_url} after {FETCH_TIMEOUT} seconds{RESET}")
+        return None
+    except etree.XMLSyntaxError as e:
+        logger.error(f"{Fore.RED}Error parsing sitemap {sitemap_url}: {str(e)}{RESET}")
+        return None
     except Exception as e:
-        logger.error(f"{Fore.RED}Error parsing sitemap: {str(e)}{Style.RESET_ALL}")
-        return []
+        logger.error(f"{Fore.RED}Exception fetching {sitemap_url}: {str(e)}{RESET}")
+        return None
 
-def safe_filename(name: str) -> str:
-    """Sanitize filename by removing illegal characters"""
-    return re.sub(r'[^a-zA-Z0-9_\-\.]', '_', name)
+async def crawl_sitemaps(client, cache, sitemap_urls, progress_bar):
+    """Fetch all sitemaps with a pool of workers, following sitemap indexes.
 
-async def process_single_sitemap(session, sitemap_url, output_folder):
-    """Process a single sitemap and save its URLs"""
-    start_time = datetime.now()
+    Returns a dict mapping each input sitemap to the unique URLs found in it
+    and in any sitemaps it links to, or None if the sitemap itself failed.
+    """
+    queue = asyncio.Queue()
+    results = {sitemap_url: [] for sitemap_url in sitemap_urls}
+    seen_urls = {sitemap_url: set() for sitemap_url in sitemap_urls}
+    # Sitemaps already queued under each input sitemap, to avoid index loops
+    queued_sitemaps = {sitemap_url: {sitemap_url} for sitemap_url in sitemap_urls}
 
-    print(f"\n📄 Fetching sitemap: {sitemap_url}")
+    for sitemap_url in sitemap_urls:
+        queue.put_nowait((sitemap_url, sitemap_url))
 
-    content = await fetch_sitemap(session, sitemap_url)
-    if not content:
-        print(f"{Fore.RED}✗ Failed to fetch sitemap:{Style.RESET_ALL} {sitemap_url}")
-        return
+    async def worker():
+        while True:
+            sitemap_url, root_url = await queue.get()
+            try:
+                parsed = await fetch_and_parse(client, cache, sitemap_url)
+                if parsed is None:
+                    if sitemap_url == root_url:
+                        results[root_url] = None
+                    continue
 
-    urls = parse_sitemap(content)
-    if not urls:
-        print(f"{Fore.RED}✗ No URLs found in sitemap:{Style.RESET_ALL} {sitemap_url}")
-        return
+                urls, child_sitemaps = parsed
+
+                # Keep only the first occurrence of each URL across the
+                # input sitemap and all of its child sitemaps
+                root_urls = results[root_url]
+                seen = seen_urls[root_url]
+                for url in urls:
+                    if url not in seen:
+                        seen.add(url)
+                        root_urls.append(url)
 
-    # Remove duplicates
-    unique_urls = list(set(urls))
+                for child_url in child_sitemaps:
+                    if child_url not in queued_sitemaps[root_url]:
+                        queued_sitemaps[root_url].add(child_url)
+                        progress_bar.total += 1
+                        queue.put_nowait((child_url, root_url))
+            finally:
+                progress_bar.update(1)
+                queue.task_done()
 
-    # Prepare file name
+    workers = [asyncio.create_task(worker()) for _ in range(CONCURRENCY)]
+    await queue.join()
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+    return results
+
+def safe_filename(name: str) -> str:
+    """Sanitize filename by removing illegal characters"""
+    return UNSAFE_FILENAME_CHARS.sub('_', name)
+
+def save_sitemap_urls(sitemap_url, urls, output_folder):
+    """Save the URLs extracted from a sitemap and return how many were saved"""
+    if urls is None:
+        return 0
+
+    if not urls:
+        logger.warning(f"{Fore.YELLOW}No URLs found in sitemap: {sitemap_url}{RESET}")
+        return 0
+
+    # Prepare file name; include the sitemap path so sitemaps from the same
+    # domain finishing within the same second don't overwrite each other
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    domain = urlparse(sitemap_url).netloc.replace('www.', '')
-    file_base = safe_filename(domain)
+    parsed = urlparse(sitemap_url)
+    domain = parsed.netloc.replace('www.', '')
+    path = parsed.path[:-3] if parsed.path.endswith('.gz') else parsed.path
+    sitemap_name = os.path.splitext(path)[0] + (f"_{parsed.query}" if parsed.query else '')
+    file_base = safe_filename(f"{domain}{sitemap_name}")
     output_filename = os.path.join(output_folder, f"{file_base}_urls_{timestamp}.txt")
 
     # Save URLs
     try:
-        with open(output_filename, 'w', encoding='utf-8') as f:
-            for url in unique_urls:
-                f.write(f"{url}\n")
-
-        end_time = datetime.now()
-        processing_time = (end_time - start_time).total_seconds()
-
-        color = get_random_color()
-        print(f"{color}✓ Saved {len(unique_urls)} URLs to {output_filename}{Style.RESET_ALL}")
-        print(f"{color}⏱️ Time taken: {processing_time:.2f} seconds{Style.RESET_ALL}")
-
+        payload = ('\n'.join(urls) + '\n').encode('utf-8')
+        Path(output_filename).write_bytes(payload)
+        return len(urls)
     except Exception as e:
-        logger.error(f"{Fore.RED}Error saving file: {str(e)}{Style.RESET_ALL}")
+        logger.error(f"{Fore.RED}Error saving file: {str(e)}{RESET}")
+        return 0
 
 async def main():
-    # Set random seed for consistent colors
-    random.seed(datetime.now().timestamp())
-
-    print(f"\n{get_random_color()}=== Sitemap URL Extractor ==={Style.RESET_ALL}")
+    print(f"\n{get_color()}=== Sitemap URL Extractor ==={RESET}")
 
     # Read sitemap URLs
     try:
         with open('sitemap_urls.txt', 'r') as f:
-            sitemap_urls = [line.strip() for line in f if line.strip()]
+            sitemap_urls = list(dict.fromkeys(line.strip() for line in f if line.strip()))
     except FileNotFoundError:
-        logger.error(f"{Fore.RED}Error: sitemap_urls.txt not found!{Style.RESET_ALL}")
+        logger.error(f"{Fore.RED}Error: sitemap_urls.txt not found!{RESET}")
         return
 
     if not sitemap_urls:
-        logger.error(f"{Fore.RED}Error: No sitemap URLs found in sitemap_urls.txt!{Style.RESET_ALL}")
+        logger.error(f"{Fore.RED}Error: No sitemap URLs found in sitemap_urls.txt!{RESET}")
         return
 
-    print(f"\n{get_random_color()}✅ Found {len(sitemap_urls)} sitemaps to process{Style.RESET_ALL}")
+    print(f"\n{get_color()}✅ Found {len(sitemap_urls)} sitemaps to process{RESET}")
 
     # Create output folder
     output_folder = "output"
     os.makedirs(output_folder, exist_ok=True)
     print(f"📂 Output folder ready: {output_folder}")
 
-    # Create a session and process each sitemap one-by-one
-    async with aiohttp.ClientSession() as session:
-        for idx, sitemap_url in enumerate(sitemap_urls, 1):
-            print(f"\n{get_random_color()}➡️ Processing sitemap {idx}/{len(sitemap_urls)}{Style.RESET_ALL}")
-            await process_single_sitemap(session, sitemap_url, output_folder)
+    # Bound concurrent connections; HTTP/2 multiplexes the requests to each
+    # host over a single connection, all sharing one SSL context. The timeout
+    # applies to each connect/read/write step; FETCH_TIMEOUT caps the total
+    limits = httpx.Limits(max_connections=CONCURRENCY)
+    timeout = httpx.Timeout(30.0)
+    ssl_context = ssl.create_default_context()
+
+    # Validators and URLs from previous runs, used to skip unchanged sitemaps
+    cache = open_cache(CACHE_FILENAME)
+
+    start_time = datetime.now()
+
+    # Throttled progress bar: redraw at most every 0.25s and every 1% of sitemaps
+    progress_bar = tqdm(
+        total=len(sitemap_urls),
+        desc=f"{get_color()}Processing sitemaps{RESET}",
+        unit="sitemap",
+        mininterval=0.25,
+        miniters=max(1, len(sitemap_urls) // 100),
+    )
+
+    # Create a client and crawl all sitemaps concurrently
+    with closing(cache), progress_bar, logging_redirect_tqdm():
+        async with httpx.AsyncClient(
+            http2=True,
+            limits=limits,
+            timeout=timeout,
+            verify=ssl_context,
+            headers=HEADERS,
+            follow_redirects=True,
+        ) as client:
+            results = await crawl_sitemaps(client, cache, sitemap_urls, progress_bar)
+
+        try:
+            cache.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"{Fore.YELLOW}Could not save cache {CACHE_FILENAME}: {str(e)}{RESET}")
+
+        saved_counts = [
+            save_sitemap_urls(sitemap_url, urls, output_folder)
+            for sitemap_url, urls in results.items()
+        ]
+
+    processing_time = (datetime.now() - start_time).total_seconds()
+    processed = sum(1 for count in saved_counts if count)
+    total_urls = sum(saved_counts)
 
-    print(f"\n🎉 {get_random_color()}All sitemaps processed successfully!{Style.RESET_ALL}")
+    color = get_color()
+    print(f"\n{color}✓ Saved {total_urls} URLs from {processed}/{len(sitemap_urls)} sitemaps to {output_folder}{RESET}")
+    print(f"{color}⏱️ Time taken: {processing_time:.2f} seconds{RESET}")
+    print(f"\n🎉 {get_color()}All sitemaps processed successfully!{RESET}")
 
 if __name__ == "__main__":
-    # Windows event loop fix
+    # Windows event loop fix; use the faster uvloop everywhere else
     if platform.system() == 'Windows':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    else:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
     try:
         asyncio.run(main())
     finally:
-        print(Style.RESET_ALL)
+        print(RESET)